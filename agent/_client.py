@@ -0,0 +1,24 @@
+import os
+import httpx
+from groq import AsyncGroq
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Initialize the shared Groq client
+api_key = os.getenv("GROQ_API_KEY")
+if not api_key:
+    raise ValueError("GROQ_API_KEY not found in .env file or environment variables. Set it in .env or as an environment variable.")
+
+# One HTTP/2 connection pool for every request, so connections stay warm across files.
+# SDK retries are disabled: utils._request_completion makes every retry decision, so each
+# attempt goes through the rate limiter.
+aclient = AsyncGroq(
+    api_key=api_key,
+    max_retries=0,
+    http_client=httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
+    )
+)
@@ -1,6 +1,13 @@
 import argparse
-import json
-from .utils import analyze_repository, analyze_local_file
+import asyncio
+import sys
+import orjson
+from .utils import analyze_repository, analyze_local_file, iter_repository_vulnerabilities, iter_local_file_vulnerabilities
+
+async def print_stream(entries):
+    """Print each report entry as a single JSON line as soon as it arrives."""
+    async for entry in entries:
+        print(orjson.dumps(entry).decode(), flush=True)
 
 def main():
     parser = argparse.ArgumentParser(
@@ -16,24 +23,36 @@ def main():
         type=str,
         help="Path to a specific file to analyze (relative to repo root if --repo-url is provided, otherwise a local file)"
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Print each vulnerability as a JSON line as soon as its file is analyzed, instead of one report at the end"
+    )
     args = parser.parse_args()
 
     if not args.repo_url and not args.file_path:
         parser.error("At least one of --repo-url or --file-path must be provided")
 
     try:
+        if args.stream:
+            if args.file_path and not args.repo_url:
+                entries = iter_local_file_vulnerabilities(args.file_path)
+            else:
+                entries = iter_repository_vulnerabilities(args.repo_url, args.file_path)
+            asyncio.run(print_stream(entries))
+            return
         if args.file_path and not args.repo_url:
             # Analyze a local file
             result = analyze_local_file(args.file_path)
         else:
             # Analyze a repository or a specific file in it
             result = analyze_repository(args.repo_url, args.file_path)
-        print(json.dumps(result, indent=2))
+        print(orjson.dumps(result, option=orjson.OPT_INDENT_2).decode())
     except ValueError as ve:
-        print(f"Error: {str(ve)}")
+        print(f"Error: {str(ve)}", file=sys.stderr)
         exit(1)
     except Exception as e:
-        print(f"Error analyzing code: {str(e)}")
+        print(f"Error analyzing code: {str(e)}", file=sys.stderr)
         exit(1)
 
 if __name__ == "__main__":
@@ -99,4 +99,25 @@ If no vulnerabilities are found, return an empty vulnerabilities list.
    - Ensure the output is strictly valid JSON, with no additional text or markdown outside the JSON structure.
 
 Provide a comprehensive report, prioritizing vulnerable Python `TypeGuard` and TypeScript `x is T` functions, followed by other predicate vulnerabilities in the codebase. Return only the JSON output, with no additional text or markdown.
+"""
+
+BATCH_PROMPT = """
+### Multiple Files
+The user message may contain several files, each wrapped in `<file path="...">...</file>` tags. Analyze each file independently and return a single JSON object keyed by the exact path from each tag, with an entry for every file (use an empty vulnerabilities list when a file has no findings). This replaces the single-file output format above:
+{
+  "path/to/file.py": {
+    "vulnerabilities": [
+      {
+        "file": "path/to/file.py",
+        "function": "string",
+        "line": integer,
+        "vulnerable_code": "string",
+        "issue": "string",
+        "corrected_code": "string",
+        "recommendations": ["string"]
+      }
+    ]
+  }
+}
+Line numbers are relative to the start of each file. Return only the JSON output, with no additional text or markdown.
 """
\ No newline at end of file
@@ -1,176 +1,572 @@
 import os
-import git
+import ast
+import asyncio
+import subprocess
+import sys
 import tempfile
-from groq import Groq
+import hashlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from groq import APIStatusError, APIConnectionError
 from pathlib import Path
-import json
-from dotenv import load_dotenv
+import orjson
 import time
+import random
 import re
-from .prompt import SYSTEM_PROMPT
+from ._client import aclient
+from .prompt import SYSTEM_PROMPT, BATCH_PROMPT
 
-# Load environment variables from .env file
-load_dotenv()
+# Upper bound on in-flight Groq requests
+MAX_CONCURRENCY = 8
 
-# Initialize Groq client
-api_key = os.getenv("GROQ_API_KEY")
-if not api_key:
-    raise ValueError("GROQ_API_KEY not found in .env file or environment variables. Set it in .env or as an environment variable.")
-client = Groq(api_key=api_key)
+# Groq requests-per-minute limit for the account tier (free tier default: 30)
+REQUESTS_PER_MINUTE = int(os.getenv("GROQ_REQUESTS_PER_MINUTE", "30"))
+
+class AsyncLimiter:
+    """Token bucket that paces requests client-side instead of waiting for a 429."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate  # tokens added per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    async def acquire(self):
+        """Wait until a request token is available, then consume it."""
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def update_from_headers(self, headers) -> None:
+        """Shrink the bucket to match Groq's rate-limit headers."""
+        self._refill()
+        remaining = headers.get("x-ratelimit-remaining-requests")
+        if remaining is not None:
+            try:
+                self.tokens = min(self.tokens, float(remaining))
+            except ValueError:
+                pass
+        retry_after = headers.get("retry-after")
+        if retry_after is not None:
+            try:
+                # Go into debt so no token is handed out before retry-after elapses
+                self.tokens = min(self.tokens, -float(retry_after) * self.rate)
+            except ValueError:
+                pass
+
+limiter = AsyncLimiter(rate=REQUESTS_PER_MINUTE / 60, capacity=REQUESTS_PER_MINUTE)
+
+# Estimated input plus reserved output tokens for the files packed into a single multi-file request.
+# The default leaves room for the system prompt under the free-tier 6000 tokens-per-minute limit of the model.
+BATCH_TOKEN_BUDGET = int(os.getenv("GROQ_BATCH_TOKEN_BUDGET", "4000"))
+
+MODEL = "llama-3.1-8b-instant"
+# Largest completion the model will produce
+MAX_OUTPUT_TOKENS = 8192
+
+# Analysis results keyed by a hash of the model, system prompt and code
+_cache_dir = Path("~/.cache/typenarrowing/").expanduser()
+_memory_cache = {}
+
+# System messages are built once and shared by every request, keeping the prompt prefix byte-identical
+_SYSTEM_MSG = {"role": "system", "content": SYSTEM_PROMPT}
+_BATCH_SYSTEM_PROMPT = SYSTEM_PROMPT + BATCH_PROMPT
+_BATCH_SYSTEM_MSG = {"role": "system", "content": _BATCH_SYSTEM_PROMPT}
+_STRICT_JSON_MSG = {"role": "user", "content": "Respond with a single valid JSON object in exactly the requested output format, with no text before or after it."}
+
+# Transient client errors worth retrying: request timeout, conflict, rate limit and Groq's capacity exceeded.
+# Server errors (5xx) are always retried.
+_RETRYABLE_STATUS_CODES = frozenset({408, 409, 429, 498})
+
+# Source file suffixes to analyze and directories that never contain first-party source
+_SUFFIXES = (".py", ".ts")
+_SKIP_DIRS = frozenset({".git", "node_modules", "__pycache__", ".venv", "venv", "dist", "build"})
+
+# Files below this size (e.g. one-line __init__.py re-exports) are not worth a request
+MIN_FILE_SIZE = 200
 
 def clone_repository(repo_url: str, temp_dir: str) -> str:
-    """Clone a GitHub repository to a temporary directory."""
+    """Shallow, blobless clone of a GitHub repository to a temporary directory, checking out only .py and .ts files."""
     repo_name = repo_url.split("/")[-1].replace(".git", "")
     clone_path = os.path.join(temp_dir, repo_name)
+    # Never block on a credential prompt for private or missing repositories
+    env = {**os.environ, "GIT_TERMINAL_PROMPT": "0"}
+    commands = [
+        ["git", "clone", "--depth=1", "--single-branch", "--filter=blob:none", "--sparse", "--jobs=8", "--", repo_url, clone_path],
+        # Non-cone patterns match at any depth, so only source blobs are fetched
+        ["git", "-C", clone_path, "sparse-checkout", "set", "--no-cone", *(f"*{suffix}" for suffix in _SUFFIXES)],
+    ]
+    for command in commands:
+        try:
+            subprocess.run(command, env=env, check=True, capture_output=True, text=True)
+        except FileNotFoundError:
+            raise ValueError(f"Failed to clone repository {repo_url}: git executable not found")
+        except subprocess.CalledProcessError as e:
+            raise ValueError(f"Failed to clone repository {repo_url}: {e.stderr.strip()}")
+    return clone_path
+
+def _walk_code_files(root: str, max_file_size: int, min_file_size: int = 0):
+    """Recursively yield DirEntry objects for .py and .ts files under root, skipping dependency and VCS directories.
+
+    os.scandir reuses the stat data from the directory listing, so each entry costs one syscall at most.
+    """
     try:
-        git.Repo.clone_from(repo_url, clone_path)
-        return clone_path
-    except git.GitCommandError as e:
-        raise ValueError(f"Failed to clone repository {repo_url}: {str(e)}")
+        entries = os.scandir(root)
+    except OSError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in _SKIP_DIRS:
+                    yield from _walk_code_files(entry.path, max_file_size, min_file_size)
+            elif entry.name.endswith(_SUFFIXES):
+                file_size = entry.stat().st_size
+                if file_size > max_file_size:
+                    print(f"Skipping {entry.path}: File size exceeds {max_file_size} bytes", file=sys.stderr)
+                    continue
+                if file_size < min_file_size:
+                    print(f"Skipping {entry.path}: File size is below {min_file_size} bytes", file=sys.stderr)
+                    continue
+                yield entry
+
+def _read_one(entry: os.DirEntry):
+    """Read a code file, returning (path, content) or None if it is empty or not UTF-8."""
+    file_path = entry.path
+    try:
+        # Raw read sized from the cached stat, decoded once without TextIOWrapper
+        with open(file_path, "rb") as f:
+            content = f.read(entry.stat().st_size).decode("utf-8")
+    except UnicodeDecodeError:
+        print(f"Skipping {file_path}: Unable to decode file as UTF-8", file=sys.stderr)
+        return None
+    if not content.strip():
+        print(f"Skipping {file_path}: File is empty", file=sys.stderr)
+        return None
+    return file_path, content
 
-def read_code_files(repo_path: str, specific_file: str = None) -> dict:
-    """Read Python and TypeScript files from the repository or a specific file."""
+def read_code_files(repo_path: str, specific_file: str = None, min_file_size: int = MIN_FILE_SIZE) -> dict:
+    """Read Python and TypeScript files from the repository or a specific file.
+
+    When walking the whole repository, files smaller than min_file_size bytes are skipped;
+    they are too small to hold a meaningful predicate function.
+    """
     code_files = {}
     max_file_size = 1_000_000  # 1MB limit
     if specific_file:
         file_path = os.path.join(repo_path, specific_file)
         if not os.path.exists(file_path):
             raise ValueError(f"File {specific_file} not found in repository")
-        if not file_path.endswith((".py", ".ts")):
+        if not file_path.endswith(_SUFFIXES):
             raise ValueError(f"File {specific_file} must be a .py or .ts file")
-        if os.path.getsize(file_path) > max_file_size:
+        file_size = os.path.getsize(file_path)
+        if file_size > max_file_size:
             raise ValueError(f"File {file_path} exceeds size limit of {max_file_size} bytes")
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read()
+            with open(file_path, "rb") as f:
+                content = f.read(file_size).decode("utf-8")
                 if not content.strip():
                     raise ValueError(f"File {file_path} is empty")
                 code_files[file_path] = content
         except UnicodeDecodeError:
             raise ValueError(f"Unable to decode {file_path} as UTF-8")
     else:
-        for root, _, files in os.walk(repo_path):
-            for file in files:
-                if file.endswith((".py", ".ts")):
-                    file_path = os.path.join(root, file)
-                    if os.path.getsize(file_path) > max_file_size:
-                        print(f"Skipping {file_path}: File size exceeds {max_file_size} bytes")
-                        continue
-                    try:
-                        with open(file_path, "r", encoding="utf-8") as f:
-                            content = f.read()
-                            if content.strip():
-                                code_files[file_path] = content
-                            else:
-                                print(f"Skipping {file_path}: File is empty")
-                    except UnicodeDecodeError:
-                        print(f"Skipping {file_path}: Unable to decode file as UTF-8")
+        # Overlap the blocking reads; file I/O releases the GIL
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            for result in executor.map(_read_one, _walk_code_files(repo_path, max_file_size, min_file_size)):
+                if result is not None:
+                    file_path, content = result
+                    code_files[file_path] = content
     return code_files
 
 def read_local_file(file_path: str) -> dict:
     """Read a local Python or TypeScript file."""
     if not os.path.exists(file_path):
         raise ValueError(f"Local file {file_path} not found")
-    if not file_path.endswith((".py", ".ts")):
+    if not file_path.endswith(_SUFFIXES):
         raise ValueError(f"File {file_path} must be a .py or .ts file")
     max_file_size = 1_000_000  # 1MB limit
-    if os.path.getsize(file_path) > max_file_size:
+    file_size = os.path.getsize(file_path)
+    if file_size > max_file_size:
         raise ValueError(f"File {file_path} exceeds size limit of {max_file_size} bytes")
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
+        with open(file_path, "rb") as f:
+            content = f.read(file_size).decode("utf-8")
             if not content.strip():
                 raise ValueError(f"File {file_path} is empty")
             return {file_path: content}
     except UnicodeDecodeError:
         raise ValueError(f"Unable to decode {file_path} as UTF-8")
 
-def extract_json_from_response(raw_response: str) -> str:
-    """Extract the JSON portion from a mixed text and JSON response."""
-    # Find the JSON block using regex (matches `{ ... }` at the end)
-    json_match = re.search(r'(\{.*\})', raw_response, re.DOTALL)
-    if json_match:
-        return json_match.group(1)
-    return ""
-
-def analyze_code_with_groq(code: str, file_path: str) -> dict:
-    """Send code to Groq API for vulnerability analysis with retry logic and JSON extraction."""
-    max_retries = 3
-    retry_delay = 5  # seconds
+# Return annotation names that mark a Python function as a candidate predicate
+_PY_PREDICATE_NAMES = frozenset({"TypeGuard", "TypeIs", "bool", "dict", "list", "Dict", "List"})
+# Identifiers inside string annotations
+_WORD_RE = re.compile(r"\w+")
+# TypeScript return annotations for type predicates, booleans and typed containers
+_TS_PREDICATE_RE = re.compile(r":\s*(?:(?:asserts\s+)?\w+\s+is\s|boolean\b|Record<|Array<)")
+
+def _annotation_names(annotation: ast.AST) -> set:
+    """Collect identifiers used in a return annotation, including string annotations."""
+    names = set()
+    for node in ast.walk(annotation):
+        if isinstance(node, ast.Name):
+            names.add(node.id)
+        elif isinstance(node, ast.Attribute):
+            names.add(node.attr)
+        elif isinstance(node, ast.Constant) and isinstance(node.value, str):
+            names.update(_WORD_RE.findall(node.value))
+    return names
+
+def has_candidate_predicates(code: str, suffix: str) -> bool:
+    """Cheaply check whether code contains functions worth sending to Groq.
+
+    Python code is parsed for functions annotated to return TypeGuard, bool, dict or list, or that call isinstance.
+    TypeScript code is matched against a regex for type predicates, boolean and typed container returns.
+    Code that cannot be parsed is treated as a candidate.
+    """
+    if suffix == ".ts":
+        return _TS_PREDICATE_RE.search(code) is not None
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return True
+    for node in ast.walk(tree):
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        if node.returns is not None and _annotation_names(node.returns) & _PY_PREDICATE_NAMES:
+            return True
+        for child in ast.walk(node):
+            if isinstance(child, ast.Call) and isinstance(child.func, ast.Name) and child.func.id == "isinstance":
+                return True
+    return False
+
+def _max_tokens_for(code_length: int) -> int:
+    """Size the completion budget to the input; Groq bills max_tokens against the TPM limit up front."""
+    return max(512, min(4000, 512 + code_length // 6))
+
+async def _request_completion(messages: list, label: str, semaphore: asyncio.Semaphore, max_tokens: int) -> str:
+    """Send a chat completion to Groq with rate limiting and retries, returning the raw message content."""
+    max_retries = 5
     for attempt in range(max_retries):
         try:
-            response = client.chat.completions.create(
-                model="llama-3.1-8b-instant",
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": f"Analyze the following code from {file_path}:\n\n```python\n{code}\n```"}
-                ],
-                max_tokens=4000,
-                temperature=0.5,
-                top_p=0.95,
-                stream=False
-            )
-            raw_content = response.choices[0].message.content
-            if not raw_content.strip():
-                print(f"Empty response from Groq API for {file_path}")
-                return {"vulnerabilities": [], "error": f"Empty response from Groq API for {file_path}"}
-
-            # Extract JSON from the response
-            json_content = extract_json_from_response(raw_content)
-            if not json_content:
-                print(f"No valid JSON found in response for {file_path}")
-                print(f"Raw response: {raw_content}")
-                return {"vulnerabilities": [], "error": f"No valid JSON found in response for {file_path}"}
-
-            try:
-                parsed_json = json.loads(json_content)
-                return parsed_json
-            except json.JSONDecodeError as e:
-                print(f"JSON decode error for {file_path}: {str(e)}")
-                print(f"Extracted JSON content: {json_content}")
-                print(f"Raw response: {raw_content}")
-                return {"vulnerabilities": [], "error": f"Invalid JSON response from Groq API: {str(e)}"}
-        except Exception as e:
+            async with semaphore:
+                await limiter.acquire()
+                raw_response = await aclient.chat.completions.with_raw_response.create(
+                    model=MODEL,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=0.5,
+                    top_p=0.95,
+                    response_format={"type": "json_object"},
+                    stream=False
+                )
+            limiter.update_from_headers(raw_response.headers)
+            response = raw_response.parse()
+            return response.choices[0].message.content
+        except (APIStatusError, APIConnectionError) as e:
+            if isinstance(e, APIStatusError):
+                limiter.update_from_headers(e.response.headers)
+                # Other client errors (bad request, auth, missing model, too large) fail the same way every time
+                if e.status_code < 500 and e.status_code not in _RETRYABLE_STATUS_CODES:
+                    raise
             if attempt < max_retries - 1:
-                print(f"Retrying {file_path} ({attempt + 1}/{max_retries}) after error: {str(e)}")
-                time.sleep(retry_delay)
+                print(f"Retrying {label} ({attempt + 1}/{max_retries}) after error: {str(e)}", file=sys.stderr)
+                # Exponential backoff with jitter
+                await asyncio.sleep(min(60, 2 ** attempt) + random.random())
                 continue
-            print(f"Failed to analyze {file_path}: {str(e)}")
-            print(f"Raw response: {raw_content if 'raw_content' in locals() else 'No response received'}")
-            return {"vulnerabilities": [], "error": f"Failed to analyze {file_path}: {str(e)}"}
-    return {"vulnerabilities": [], "error": f"Failed to analyze {file_path} after {max_retries} attempts"}
+            raise
 
-def analyze_repository(repo_url: str, specific_file: str = None) -> dict:
-    """Analyze a GitHub repository or a specific file in it for vulnerable predicate functions."""
+def _is_json_validation_error(error: APIStatusError) -> bool:
+    """Whether Groq rejected a JSON-mode completion because the model produced invalid JSON."""
+    body = error.body if isinstance(error.body, dict) else {}
+    details = body.get("error", body)
+    return isinstance(details, dict) and details.get("code") == "json_validate_failed"
+
+async def _complete_json(messages: list, label: str, semaphore: asyncio.Semaphore, max_tokens: int) -> dict:
+    """Request a JSON-mode completion and parse it, or return an error result.
+
+    Invalid JSON is retried once with a stricter instruction appended; API errors are raised.
+    """
+    for strict in (False, True):
+        try:
+            raw_content = await _request_completion(messages + [_STRICT_JSON_MSG] if strict else messages, label, semaphore, max_tokens)
+        except APIStatusError as e:
+            if strict or not _is_json_validation_error(e):
+                raise
+            print(f"Invalid JSON from Groq API for {label}, retrying with a stricter instruction", file=sys.stderr)
+            continue
+        try:
+            return orjson.loads(raw_content or "")
+        except orjson.JSONDecodeError as e:
+            if not strict:
+                print(f"JSON decode error for {label}, retrying with a stricter instruction: {str(e)}", file=sys.stderr)
+                continue
+            print(f"JSON decode error for {label}: {str(e)}", file=sys.stderr)
+            print(f"Raw response: {raw_content}", file=sys.stderr)
+            return {"vulnerabilities": [], "error": f"Invalid JSON response from Groq API: {str(e)}"}
+
+def _reattribute(vulnerabilities: list, file_path: str) -> list:
+    """Copy vulnerability entries with their file field pointing at file_path."""
+    return [dict(v, file=file_path) if isinstance(v, dict) else v for v in vulnerabilities]
+
+def _cache_key(code: str, system_prompt: str) -> str:
+    return hashlib.sha256((MODEL + system_prompt + code).encode("utf-8")).hexdigest()
+
+def _read_cache_entry(key: str):
+    analysis = _memory_cache.get(key)
+    if analysis is None:
+        try:
+            with open(_cache_dir / key[:2] / key, "rb") as f:
+                analysis = orjson.loads(f.read())
+        except (OSError, ValueError):
+            return None
+        if not isinstance(analysis, dict) or not isinstance(analysis.get("vulnerabilities"), list):
+            return None
+        _memory_cache[key] = analysis
+    return analysis
+
+def _load_cached_analysis(code: str, file_path: str, system_prompts: tuple = (SYSTEM_PROMPT,)):
+    """Return the cached analysis for code, attributed to file_path, or None on a cache miss.
+
+    Entries produced under each of system_prompts are accepted, in order.
+    """
+    for system_prompt in system_prompts:
+        analysis = _read_cache_entry(_cache_key(code, system_prompt))
+        if analysis is not None:
+            # Identical code may live at a different path than when it was cached
+            return {"vulnerabilities": _reattribute(analysis["vulnerabilities"], file_path)}
+    return None
+
+def _store_cached_analysis(code: str, analysis: dict, system_prompt: str = SYSTEM_PROMPT) -> None:
+    """Cache a successful analysis in memory and on disk; failed analyses are never cached."""
+    if "error" in analysis or not isinstance(analysis.get("vulnerabilities"), list):
+        return
+    key = _cache_key(code, system_prompt)
+    analysis = {"vulnerabilities": analysis["vulnerabilities"]}
+    _memory_cache[key] = analysis
+    cache_path = _cache_dir / key[:2] / key
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file and rename so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=cache_path.parent)
+        with os.fdopen(fd, "wb") as f:
+            f.write(orjson.dumps(analysis))
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"Unable to write analysis cache {cache_path}: {str(e)}", file=sys.stderr)
+
+async def analyze_code_with_groq(code: str, file_path: str, semaphore: asyncio.Semaphore = None) -> dict:
+    """Send code to Groq API for vulnerability analysis with retry logic and JSON mode.
+
+    Results are cached by content, so unchanged code is never sent twice.
+    """
+    cached = _load_cached_analysis(code, file_path)
+    if cached is not None:
+        return cached
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    messages = [
+        _SYSTEM_MSG,
+        {"role": "user", "content": f"Analyze the following code from {file_path}:\n\n```python\n{code}\n```"}
+    ]
+    try:
+        analysis = await _complete_json(messages, file_path, semaphore, _max_tokens_for(len(code)))
+    except Exception as e:
+        print(f"Failed to analyze {file_path}: {str(e)}", file=sys.stderr)
+        return {"vulnerabilities": [], "error": str(e)}
+    _store_cached_analysis(code, analysis)
+    return analysis
+
+async def analyze_code_batch(files: list, semaphore: asyncio.Semaphore = None) -> dict:
+    """Analyze several (path, code) pairs in one Groq request and return the analysis keyed by path.
+
+    Cached files are answered locally. Files the batch response does not cover, or every file when the
+    batch request itself fails, are re-analyzed individually.
+    """
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    results = {}
+    uncached = []
+    for file_path, code in files:
+        # Batch results are keyed by the batch prompt, so a single-file analysis never reuses one
+        cached = _load_cached_analysis(code, file_path, (SYSTEM_PROMPT, _BATCH_SYSTEM_PROMPT))
+        if cached is not None:
+            results[file_path] = cached
+        else:
+            uncached.append((file_path, code))
+    if len(uncached) <= 1:
+        for file_path, code in uncached:
+            results[file_path] = await analyze_code_with_groq(code, file_path, semaphore)
+        return results
+
+    label = f"batch of {len(uncached)} files"
+    file_blocks = "\n\n".join(f'<file path="{file_path}">\n{code}\n</file>' for file_path, code in uncached)
+    messages = [
+        _BATCH_SYSTEM_MSG,
+        {"role": "user", "content": f"Analyze the following files:\n\n{file_blocks}"}
+    ]
+    try:
+        # Each file keeps the output budget it would get on its own
+        max_tokens = min(MAX_OUTPUT_TOKENS, sum(_max_tokens_for(len(code)) for _, code in uncached))
+        parsed = await _complete_json(messages, label, semaphore, max_tokens)
+    except Exception as e:
+        print(f"Failed to analyze {label}: {str(e)}", file=sys.stderr)
+        parsed = {}
+
+    missing = []
+    for file_path, code in uncached:
+        analysis = parsed.get(file_path)
+        if isinstance(analysis, dict) and isinstance(analysis.get("vulnerabilities"), list):
+            results[file_path] = {"vulnerabilities": analysis["vulnerabilities"]}
+            _store_cached_analysis(code, results[file_path], _BATCH_SYSTEM_PROMPT)
+        else:
+            missing.append((file_path, code))
+    if missing:
+        print(f"Falling back to per-file analysis for {len(missing)} file(s) not covered by {label}", file=sys.stderr)
+        analyses = await asyncio.gather(*(analyze_code_with_groq(code, file_path, semaphore) for file_path, code in missing))
+        results.update(zip((file_path for file_path, _ in missing), analyses))
+    return results
+
+def _estimate_tokens(code: str) -> int:
+    """Roughly estimate the token count of a piece of source code."""
+    return len(code) // 4
+
+def _group_into_batches(files: list) -> list:
+    """Group (path, code) pairs into batches whose input and output tokens stay under BATCH_TOKEN_BUDGET.
+
+    Files that exceed the budget on their own get a batch to themselves.
+    """
+    batches = []
+    current, current_tokens = [], 0
+    for file_path, code in files:
+        tokens = _estimate_tokens(code) + _max_tokens_for(len(code))
+        if tokens > BATCH_TOKEN_BUDGET:
+            batches.append([(file_path, code)])
+            continue
+        if current and current_tokens + tokens > BATCH_TOKEN_BUDGET:
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append((file_path, code))
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def _display_path(file_path: str, base_path: str = None) -> str:
+    return os.path.relpath(file_path, base_path) if base_path else file_path
+
+def _analysis_entries(display_path: str, analysis: dict) -> list:
+    """Flatten one file's analysis into report entries, turning an error into its own entry.
+
+    Analysis errors do not name a file, so the same result can be reported under any duplicate path.
+    """
+    entries = list(analysis.get("vulnerabilities", []))
+    if "error" in analysis:
+        entries.append({"file": display_path, "error": f"Failed to analyze {display_path}: {analysis['error']}"})
+    return entries
+
+async def _iter_code_file_analyses(code_files: dict, base_path: str = None):
+    """Yield (display_path, analysis) pairs as soon as the request covering each file completes.
+
+    Files are deduplicated and sent in token-budgeted batches, with at most MAX_CONCURRENCY requests in flight.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    display_files = {}
+    for file_path, code in code_files.items():
+        display_path = _display_path(file_path, base_path)
+        print(f"\nAnalyzing {display_path}...", file=sys.stderr)
+        display_files[display_path] = code
+
+    # Send byte-identical files once, under the first path they appear at
+    paths_by_digest = defaultdict(list)
+    unique_files = {}
+    for display_path, code in display_files.items():
+        digest = hashlib.blake2b(code.encode("utf-8"), digest_size=16).digest()
+        paths_by_digest[digest].append(display_path)
+        unique_files.setdefault(digest, (display_path, code))
+    duplicates = {paths[0]: paths[1:] for paths in paths_by_digest.values()}
+    batches = _group_into_batches(list(unique_files.values()))
+
+    async def run_batch(batch: list):
+        try:
+            return batch, await analyze_code_batch(batch, semaphore)
+        except Exception as e:
+            return batch, e
+
+    for next_result in asyncio.as_completed([run_batch(batch) for batch in batches]):
+        batch, batch_result = await next_result
+        # Scatter batch results back to their files, fanning each out to its duplicates
+        for display_path, _ in batch:
+            if isinstance(batch_result, Exception):
+                analysis = {"vulnerabilities": [], "error": str(batch_result)}
+            else:
+                analysis = batch_result[display_path]
+            # Attribute findings to the analyzed path so fresh and cached runs report the same file
+            yield display_path, dict(analysis, vulnerabilities=_reattribute(analysis.get("vulnerabilities", []), display_path))
+            for duplicate_path in duplicates[display_path]:
+                yield duplicate_path, dict(analysis, vulnerabilities=_reattribute(analysis.get("vulnerabilities", []), duplicate_path))
+
+async def _analyze_code_files(code_files: dict, base_path: str = None) -> list:
+    """Analyze code files and return their report entries in file order."""
+    analyses = {}
+    async for display_path, analysis in _iter_code_file_analyses(code_files, base_path):
+        analyses[display_path] = analysis
+
+    all_vulnerabilities = []
+    for file_path in code_files:
+        display_path = _display_path(file_path, base_path)
+        all_vulnerabilities.extend(_analysis_entries(display_path, analyses[display_path]))
+    return all_vulnerabilities
+
+def _read_repository_files(repo_url: str, specific_file: str = None) -> tuple:
+    """Clone a repository and return (code_files, repo_path) for the files worth analyzing.
+
+    The clone is removed before returning; repo_path is only used to relativize file paths.
+    """
     with tempfile.TemporaryDirectory() as temp_dir:
         # Clone the repository
         repo_path = clone_repository(repo_url, temp_dir)
-        
+
         # Read code files
         code_files = read_code_files(repo_path, specific_file)
-        
-        # Analyze each file
-        all_vulnerabilities = []
-        for file_path, code in code_files.items():
-            relative_path = os.path.relpath(file_path, repo_path)
-            print(f"\nAnalyzing {relative_path}...")
-            analysis = analyze_code_with_groq(code, relative_path)
-            if "vulnerabilities" in analysis:
-                all_vulnerabilities.extend(analysis["vulnerabilities"])
-            if "error" in analysis:
-                all_vulnerabilities.append({"file": relative_path, "error": analysis["error"]})
-        
-        return {"vulnerabilities": all_vulnerabilities}
+
+    # Only send files that contain candidate predicate functions
+    if not specific_file:
+        for file_path in list(code_files):
+            if not has_candidate_predicates(code_files[file_path], os.path.splitext(file_path)[1]):
+                print(f"Skipping {os.path.relpath(file_path, repo_path)}: No candidate predicate functions", file=sys.stderr)
+                del code_files[file_path]
+    return code_files, repo_path
+
+def analyze_repository(repo_url: str, specific_file: str = None) -> dict:
+    """Analyze a GitHub repository or a specific file in it for vulnerable predicate functions."""
+    code_files, repo_path = _read_repository_files(repo_url, specific_file)
+    all_vulnerabilities = asyncio.run(_analyze_code_files(code_files, repo_path))
+    return {"vulnerabilities": all_vulnerabilities}
 
 def analyze_local_file(file_path: str) -> dict:
     """Analyze a local file for vulnerable predicate functions."""
     code_files = read_local_file(file_path)
-    all_vulnerabilities = []
-    for file_path, code in code_files.items():
-        print(f"\nAnalyzing {file_path}...")
-        analysis = analyze_code_with_groq(code, file_path)
-        if "vulnerabilities" in analysis:
-            all_vulnerabilities.extend(analysis["vulnerabilities"])
-        if "error" in analysis:
-            all_vulnerabilities.append({"file": file_path, "error": analysis["error"]})
-    return {"vulnerabilities": all_vulnerabilities}
\ No newline at end of file
+    all_vulnerabilities = asyncio.run(_analyze_code_files(code_files))
+    return {"vulnerabilities": all_vulnerabilities}
+
+async def iter_repository_vulnerabilities(repo_url: str, specific_file: str = None):
+    """Like analyze_repository, but yield report entries as soon as each file's analysis completes."""
+    code_files, repo_path = _read_repository_files(repo_url, specific_file)
+    async for display_path, analysis in _iter_code_file_analyses(code_files, repo_path):
+        for entry in _analysis_entries(display_path, analysis):
+            yield entry
+
+async def iter_local_file_vulnerabilities(file_path: str):
+    """Like analyze_local_file, but yield report entries as soon as the analysis completes."""
+    code_files = read_local_file(file_path)
+    async for display_path, analysis in _iter_code_file_analyses(code_files):
+        for entry in _analysis_entries(display_path, analysis):
+            yield entry
@@ -1 +1,371 @@
-pass
\ No newline at end of file
+import asyncio
+import os
+import time
+
+os.environ.setdefault("GROQ_API_KEY", "test-key")
+
+from agent import utils
+
+
+def test_limiter_hands_out_burst_then_paces():
+    limiter = utils.AsyncLimiter(rate=100, capacity=3)
+
+    async def acquire_all():
+        start = time.monotonic()
+        for _ in range(5):
+            await limiter.acquire()
+        return time.monotonic() - start
+
+    # 3 tokens are available immediately, the other 2 refill at 100/s
+    assert 0.015 <= asyncio.run(acquire_all()) < 0.5
+
+
+def test_limiter_caps_tokens_to_remaining_requests_header():
+    limiter = utils.AsyncLimiter(rate=1, capacity=30)
+    limiter.update_from_headers({"x-ratelimit-remaining-requests": "2"})
+    assert limiter.tokens <= 2
+
+
+def test_limiter_goes_into_debt_on_retry_after():
+    limiter = utils.AsyncLimiter(rate=100, capacity=30)
+    limiter.update_from_headers({"retry-after": "0.1"})
+    assert limiter.tokens <= -9.9
+
+    async def acquire():
+        start = time.monotonic()
+        await limiter.acquire()
+        return time.monotonic() - start
+
+    # The debt has to be repaid before the next token is handed out
+    assert asyncio.run(acquire()) >= 0.1
+
+
+def test_limiter_ignores_malformed_headers():
+    limiter = utils.AsyncLimiter(rate=1, capacity=5)
+    limiter.update_from_headers({"x-ratelimit-remaining-requests": "n/a", "retry-after": "soon"})
+    assert limiter.tokens == 5
+
+
+def test_group_into_batches_respects_token_budget(monkeypatch):
+    # Each file costs len // 4 input tokens plus its own max(512, ...) output budget
+    monkeypatch.setattr(utils, "BATCH_TOKEN_BUDGET", 1200)
+    files = [("f1.py", "x" * 40), ("f2.py", "x" * 80), ("f3.py", "x" * 400), ("f4.py", "x" * 4000), ("f5.py", "x" * 4)]
+    batches = utils._group_into_batches(files)
+    assert [[path for path, _ in batch] for batch in batches] == [["f1.py", "f2.py"], ["f4.py"], ["f3.py", "f5.py"]]
+    # Every file lands in exactly one batch
+    assert sorted(path for batch in batches for path, _ in batch) == sorted(path for path, _ in files)
+
+
+def test_failed_batch_falls_back_to_per_file_analysis(monkeypatch):
+    monkeypatch.setattr(utils, "_load_cached_analysis", lambda *args, **kwargs: None)
+
+    async def failing_complete_json(*args, **kwargs):
+        raise RuntimeError("413 request too large")
+
+    analyzed = []
+
+    async def fake_analyze(code, file_path, semaphore=None):
+        analyzed.append(file_path)
+        return {"vulnerabilities": [{"file": file_path, "function": "f"}]}
+
+    monkeypatch.setattr(utils, "_complete_json", failing_complete_json)
+    monkeypatch.setattr(utils, "analyze_code_with_groq", fake_analyze)
+    files = [("a.py", "code a"), ("b.py", "code b"), ("c.py", "code c")]
+    results = asyncio.run(utils.analyze_code_batch(files))
+    assert sorted(analyzed) == ["a.py", "b.py", "c.py"]
+    assert all("error" not in analysis for analysis in results.values())
+
+
+def test_python_return_annotations_mark_candidates():
+    assert utils.has_candidate_predicates("from typing import TypeGuard\ndef f(x) -> TypeGuard[int]:\n    return True\n", ".py")
+    assert utils.has_candidate_predicates("def f(x) -> bool:\n    return True\n", ".py")
+    assert utils.has_candidate_predicates("import typing\ndef f(x) -> typing.Dict[str, int]:\n    return {}\n", ".py")
+    assert utils.has_candidate_predicates("async def f(x) -> list[int]:\n    return []\n", ".py")
+
+
+def test_python_string_annotations_mark_candidates():
+    assert utils.has_candidate_predicates("def f(x) -> 'TypeGuard[dict[str, int]]':\n    return True\n", ".py")
+
+
+def test_python_isinstance_body_marks_candidates():
+    assert utils.has_candidate_predicates("def f(x):\n    return isinstance(x, int)\n", ".py")
+
+
+def test_python_without_predicates_is_skipped():
+    code = "import os\n\nVALUE = 1\n\ndef add(a: int, b: int) -> int:\n    return a + b\n\nisinstance(VALUE, int)\n"
+    assert not utils.has_candidate_predicates(code, ".py")
+
+
+def test_unparseable_python_is_kept():
+    assert utils.has_candidate_predicates("def f(:\n", ".py")
+
+
+def test_typescript_predicates_mark_candidates():
+    assert utils.has_candidate_predicates("function isNum(x: unknown): x is number { return true; }", ".ts")
+    assert utils.has_candidate_predicates("function isFoo(value: any): value is Foo { return true; }", ".ts")
+    assert utils.has_candidate_predicates("function check(v: unknown): asserts v is string {}", ".ts")
+    assert utils.has_candidate_predicates("const ok = (v: unknown): boolean => true;", ".ts")
+    assert utils.has_candidate_predicates("function m(v: any): Record<string, number> { return v; }", ".ts")
+
+
+def test_typescript_without_predicates_is_skipped():
+    assert not utils.has_candidate_predicates("export const x = 1;\nexport function add(a: number, b: number): number { return a + b; }\n", ".ts")
+
+
+def test_batch_results_are_cached_separately_from_single_file_results(monkeypatch, tmp_path):
+    monkeypatch.setattr(utils, "_cache_dir", tmp_path)
+    monkeypatch.setattr(utils, "_memory_cache", {})
+    utils._store_cached_analysis("code", {"vulnerabilities": [{"file": "a.py"}]}, utils._BATCH_SYSTEM_PROMPT)
+    assert utils._load_cached_analysis("code", "b.py") is None
+    cached = utils._load_cached_analysis("code", "b.py", (utils.SYSTEM_PROMPT, utils._BATCH_SYSTEM_PROMPT))
+    assert cached == {"vulnerabilities": [{"file": "b.py"}]}
+
+
+def test_batch_output_budget_is_summed_per_file(monkeypatch):
+    monkeypatch.setattr(utils, "_load_cached_analysis", lambda *args, **kwargs: None)
+    budgets = []
+
+    async def fake_complete_json(messages, label, semaphore, max_tokens):
+        budgets.append(max_tokens)
+        return {f"f{i}.py": {"vulnerabilities": []} for i in range(40)}
+
+    monkeypatch.setattr(utils, "_complete_json", fake_complete_json)
+    files = [(f"f{i}.py", "x" * 300) for i in range(40)]
+    asyncio.run(utils.analyze_code_batch(files))
+    assert budgets == [min(utils.MAX_OUTPUT_TOKENS, 40 * utils._max_tokens_for(300))]
+
+
+def test_duplicate_files_are_analyzed_once_and_fanned_out(monkeypatch):
+    sent = []
+
+    async def fake_batch(files, semaphore=None):
+        sent.extend(path for path, _ in files)
+        return {path: {"vulnerabilities": [{"file": path, "function": "f"}]} for path, _ in files}
+
+    monkeypatch.setattr(utils, "analyze_code_batch", fake_batch)
+    code_files = {"/repo/a.py": "same code", "/repo/b.py": "other code", "/repo/pkg/a.py": "same code"}
+    entries = asyncio.run(utils._analyze_code_files(code_files, "/repo"))
+    assert sorted(sent) == ["a.py", "b.py"]
+    assert [entry["file"] for entry in entries] == ["a.py", "b.py", os.path.join("pkg", "a.py")]
+
+
+def test_duplicate_file_errors_name_the_duplicate(monkeypatch):
+    async def failing_batch(files, semaphore=None):
+        return {path: {"vulnerabilities": [], "error": "boom"} for path, _ in files}
+
+    monkeypatch.setattr(utils, "analyze_code_batch", failing_batch)
+    code_files = {"/repo/a.py": "same code", "/repo/dup.py": "same code"}
+    entries = asyncio.run(utils._analyze_code_files(code_files, "/repo"))
+    assert entries == [
+        {"file": "a.py", "error": "Failed to analyze a.py: boom"},
+        {"file": "dup.py", "error": "Failed to analyze dup.py: boom"},
+    ]
+
+
+def test_progress_messages_go_to_stderr(monkeypatch, capsys):
+    async def fake_batch(files, semaphore=None):
+        return {path: {"vulnerabilities": []} for path, _ in files}
+
+    monkeypatch.setattr(utils, "analyze_code_batch", fake_batch)
+    asyncio.run(utils._analyze_code_files({"/repo/a.py": "code"}, "/repo"))
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    assert "Analyzing a.py" in captured.err
+
+
+def _status_error(error_class, status_code):
+    import httpx
+
+    response = httpx.Response(status_code, request=httpx.Request("POST", "https://api.groq.com/openai/v1/chat/completions"))
+    return error_class(f"{status_code} error", response=response, body=None)
+
+
+class _FailingCompletions:
+    def __init__(self, error):
+        self.error = error
+        self.calls = 0
+
+    @property
+    def with_raw_response(self):
+        return self
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        raise self.error
+
+
+def _count_attempts(monkeypatch, error):
+    from types import SimpleNamespace
+
+    completions = _FailingCompletions(error)
+    monkeypatch.setattr(utils, "aclient", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    monkeypatch.setattr(utils, "limiter", utils.AsyncLimiter(rate=1000, capacity=1000))
+
+    async def no_sleep(delay):
+        pass
+
+    monkeypatch.setattr(utils.asyncio, "sleep", no_sleep)
+    messages = [{"role": "user", "content": "code"}]
+    try:
+        asyncio.run(utils._request_completion(messages, "a.py", asyncio.Semaphore(1), 512))
+    except Exception as e:
+        assert e is error
+    return completions.calls
+
+
+def test_transient_connection_and_server_errors_are_retried(monkeypatch):
+    import httpx
+    from groq import APIConnectionError, APIStatusError, InternalServerError, RateLimitError
+
+    connection_error = APIConnectionError(request=httpx.Request("POST", "https://api.groq.com/openai/v1/chat/completions"))
+    assert _count_attempts(monkeypatch, connection_error) == 5
+    for status_code in (408, 409, 498):
+        assert _count_attempts(monkeypatch, _status_error(APIStatusError, status_code)) == 5
+
+    assert _count_attempts(monkeypatch, _status_error(RateLimitError, 429)) == 5
+    assert _count_attempts(monkeypatch, _status_error(InternalServerError, 500)) == 5
+    assert _count_attempts(monkeypatch, _status_error(APIStatusError, 503)) == 5
+
+
+def test_client_errors_are_not_retried(monkeypatch):
+    from groq import APIStatusError, AuthenticationError, BadRequestError
+
+    assert _count_attempts(monkeypatch, _status_error(BadRequestError, 400)) == 1
+    assert _count_attempts(monkeypatch, _status_error(AuthenticationError, 401)) == 1
+    for status_code in (402, 403, 404, 413, 422):
+        assert _count_attempts(monkeypatch, _status_error(APIStatusError, status_code)) == 1
+
+
+def test_sdk_retries_are_disabled():
+    # Every attempt must go through _request_completion and the rate limiter
+    assert utils.aclient.max_retries == 0
+
+
+def test_findings_are_attributed_to_the_analyzed_path(monkeypatch):
+    async def fake_batch(files, semaphore=None):
+        return {path: {"vulnerabilities": [{"file": "single", "function": "f"}]} for path, _ in files}
+
+    monkeypatch.setattr(utils, "analyze_code_batch", fake_batch)
+    entries = asyncio.run(utils._analyze_code_files({"/repo/a.py": "code"}, "/repo"))
+    assert entries == [{"file": "a.py", "function": "f"}]
+
+
+def test_read_code_files_applies_size_limits_and_skips_directories(tmp_path):
+    body = "def is_int(x) -> bool:\n    return isinstance(x, int)\n" + "# padding\n" * 30
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "kept.py").write_text(body)
+    (tmp_path / "kept.ts").write_text("export function isNum(x: unknown): x is number { return true; }\n" + "// pad\n" * 30)
+    (tmp_path / "pkg" / "__init__.py").write_text("from .kept import is_int\n")
+    (tmp_path / "huge.py").write_text("#" * 1_000_001)
+    (tmp_path / "notes.md").write_text(body)
+    for skipped in ("node_modules", ".git", "venv", "__pycache__", "build"):
+        (tmp_path / skipped).mkdir()
+        (tmp_path / skipped / "vendored.py").write_text(body)
+
+    code_files = utils.read_code_files(str(tmp_path))
+    assert sorted(os.path.relpath(path, tmp_path) for path in code_files) == ["kept.ts", os.path.join("pkg", "kept.py")]
+    assert len((tmp_path / "pkg" / "__init__.py").read_bytes()) < utils.MIN_FILE_SIZE
+
+    # The size floor can be lowered
+    code_files = utils.read_code_files(str(tmp_path), min_file_size=0)
+    assert os.path.join(str(tmp_path), "pkg", "__init__.py") in code_files
+
+
+def test_read_code_files_reads_small_specific_file(tmp_path):
+    (tmp_path / "tiny.py").write_text("x = 1\n")
+    code_files = utils.read_code_files(str(tmp_path), "tiny.py")
+    assert code_files == {os.path.join(str(tmp_path), "tiny.py"): "x = 1\n"}
+
+
+class _ScriptedCompletions:
+    """Stub completions endpoint that raises or returns each scripted outcome in turn."""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.messages = []
+
+    @property
+    def with_raw_response(self):
+        return self
+
+    async def create(self, **kwargs):
+        from types import SimpleNamespace
+
+        self.messages.append(kwargs["messages"])
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        response = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=outcome))])
+        return SimpleNamespace(headers={}, parse=lambda: response)
+
+
+def _complete_json_with(monkeypatch, outcomes):
+    from types import SimpleNamespace
+
+    completions = _ScriptedCompletions(outcomes)
+    monkeypatch.setattr(utils, "aclient", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    monkeypatch.setattr(utils, "limiter", utils.AsyncLimiter(rate=1000, capacity=1000))
+    messages = [{"role": "user", "content": "code"}]
+    result = asyncio.run(utils._complete_json(messages, "a.py", asyncio.Semaphore(1), 512))
+    return result, completions.messages
+
+
+def _json_validate_failed():
+    from groq import BadRequestError
+
+    error = _status_error(BadRequestError, 400)
+    error.body = {"code": "json_validate_failed", "message": "Failed to generate JSON"}
+    return error
+
+
+def test_json_validation_error_is_retried_with_strict_instruction(monkeypatch):
+    result, sent = _complete_json_with(monkeypatch, [_json_validate_failed(), '{"vulnerabilities": []}'])
+    assert result == {"vulnerabilities": []}
+    assert len(sent) == 2
+    assert sent[0][-1] != utils._STRICT_JSON_MSG
+    assert sent[1][-1] == utils._STRICT_JSON_MSG
+
+
+def test_json_validation_error_is_raised_after_strict_retry(monkeypatch):
+    first, second = _json_validate_failed(), _json_validate_failed()
+    try:
+        _complete_json_with(monkeypatch, [first, second])
+    except Exception as e:
+        assert e is second
+    else:
+        raise AssertionError("expected the second json_validate_failed error to be raised")
+
+
+def test_other_bad_requests_are_not_retried_as_json_errors(monkeypatch):
+    from groq import BadRequestError
+
+    error = _status_error(BadRequestError, 400)
+    error.body = {"code": "model_not_found"}
+    try:
+        _complete_json_with(monkeypatch, [error, '{"vulnerabilities": []}'])
+    except Exception as e:
+        assert e is error
+    else:
+        raise AssertionError("expected the bad request to be raised")
+
+
+def test_undecodable_body_is_retried_with_strict_instruction(monkeypatch):
+    result, sent = _complete_json_with(monkeypatch, ["not json", '{"vulnerabilities": [{"function": "f"}]}'])
+    assert result == {"vulnerabilities": [{"function": "f"}]}
+    assert sent[1][-1] == utils._STRICT_JSON_MSG
+
+
+def test_undecodable_body_after_strict_retry_returns_error(monkeypatch):
+    result, sent = _complete_json_with(monkeypatch, ["not json", "still not json"])
+    assert len(sent) == 2
+    assert result["vulnerabilities"] == []
+    assert result["error"].startswith("Invalid JSON response from Groq API")
+
+
+def test_json_validation_error_body_shapes():
+    error = _json_validate_failed()
+    assert utils._is_json_validation_error(error)
+    error.body = {"error": {"code": "json_validate_failed"}}
+    assert utils._is_json_validation_error(error)
+    error.body = None
+    assert not utils._is_json_validation_error(error)